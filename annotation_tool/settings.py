@@ -134,3 +134,27 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Auto-detect (YOLO-World + SAM) result cache
+# Defaults live in annotator/autodetect.py; uncomment to override, e.g. to precompute
+# the default prompt right after upload:
+# AUTO_DETECT_WARM_ON_UPLOAD = True
+# AUTO_DETECT_DEFAULT_PROMPT = "car, asphalt, vegetation, sky"
+# AUTO_DETECT_MODEL_VERSION = 'yolov8l-worldv2+mobile_sam/v2'
+
+
+# Media serving (annotator/media.py)
+# To let nginx send the bytes, set MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/' with:
+#   location /protected-media/ { internal; alias /path/to/media/; }
+# For Apache mod_xsendfile / lighttpd use MEDIA_SENDFILE_HEADER = 'X-Sendfile' instead.
+
+MEDIA_ACCEL_REDIRECT_PREFIX = None
+
+MEDIA_SENDFILE_HEADER = None
+
+# Optional override of annotator.media.DEFAULT_CACHE_CONTROL (longest matching prefix wins), e.g.:
+# MEDIA_CACHE_CONTROL = {
+#     'individual_masks/': 'no-cache',
+#     '': 'public, max-age=604800',
+# }
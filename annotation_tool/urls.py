@@ -15,9 +15,9 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings                   
-from django.conf.urls.static import static         
+from annotator.media import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,5 +25,8 @@ urlpatterns = [
 ]
 
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Served in all modes (not just DEBUG); see annotator/media.py for caching, ranges
+# and proxy offload via MEDIA_ACCEL_REDIRECT_PREFIX / MEDIA_SENDFILE_HEADER.
+urlpatterns += [
+    re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='serve_media'),
+]
\ No newline at end of file
@@ -0,0 +1,172 @@
+"""
+Auto-detect (YOLO-World boxes + SAM masks) with a result cache.
+
+The weights are loaded on first use rather than at import, so views.py and the
+test suite can import this module without them.
+"""
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+
+from .models import AnnotatedImage, AutoDetectResult
+
+# Defaults live here; settings.py may override any of them.
+# Bump the model version whenever weights or post-processing change so stale cache rows are ignored.
+MODEL_VERSION = getattr(settings, 'AUTO_DETECT_MODEL_VERSION', 'yolov8l-worldv2+mobile_sam/v1')
+DEFAULT_PROMPT = getattr(settings, 'AUTO_DETECT_DEFAULT_PROMPT', "car, person, tree, cloud, building")
+WARM_ON_UPLOAD = getattr(settings, 'AUTO_DETECT_WARM_ON_UPLOAD', False)
+DEFAULT_CONF = 0.15
+DEFAULT_IOU = 0.5
+
+# detector.set_classes() mutates shared model state, so inference must be serialized.
+_inference_lock = threading.Lock()
+_detector = None
+_segmenter = None
+
+# One background worker for cache warm-up; bulk uploads queue jobs instead of spawning threads.
+_warm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='auto-detect-warm')
+
+
+def _load_models():
+    global _detector, _segmenter
+    if _detector is None:
+        from ultralytics import SAM, YOLO
+
+        # model = YOLO('yolov8l-seg.pt')
+        _detector = YOLO('yolov8l-worldv2.pt')
+        _segmenter = SAM('mobile_sam.pt')
+    return _detector, _segmenter
+
+
+def normalize_classes(prompt):
+    """
+    Turns a comma-separated prompt into a canonical class list:
+    trimmed, lower-cased, de-duplicated and sorted, so equivalent prompts share a cache key.
+    """
+    classes = {x.strip().lower() for x in prompt.split(',')}
+    classes.discard('')
+    return sorted(classes)
+
+
+def parse_threshold(request, name, default):
+    """
+    Reads a 0-1 float query param. Returns (value, error message).
+    """
+    raw = request.GET.get(name)
+    if raw is None:
+        return default, None
+    try:
+        value = float(raw)
+    except ValueError:
+        return None, f"'{name}' must be a number"
+    if not 0.0 <= value <= 1.0:
+        return None, f"'{name}' must be between 0 and 1"
+    return value, None
+
+
+def run_detection_pipeline(image_path, custom_classes, conf=DEFAULT_CONF, iou=DEFAULT_IOU):
+    """
+    Runs YOLO-World for boxes then SAM for masks. Returns Fabric-style polygon annotations.
+    """
+    with _inference_lock:
+        detector, segmenter = _load_models()
+
+        detector.set_classes(custom_classes)
+        detect_results = detector.predict(image_path, conf=conf, iou=iou)
+        det_result = detect_results[0]
+
+        new_annotations = []
+
+        if det_result.boxes:
+            print(f"DEBUG: Step 2 - Found {len(det_result.boxes)} boxes. Refining with SAM...")
+
+            bboxes = det_result.boxes.xyxy
+
+            seg_results = segmenter(image_path, bboxes=bboxes)
+            seg_result = seg_results[0]
+
+            if seg_result.masks:
+                for i, mask in enumerate(seg_result.masks.xy):
+
+
+                    if len(mask) < 3: continue
+
+                    points = [{'x': float(pt[0]), 'y': float(pt[1])} for pt in mask]
+
+                    cls_id = int(det_result.boxes.cls[i].item())
+                    if cls_id < len(custom_classes):
+                        label_name = custom_classes[cls_id]
+                    else:
+                        label_name = "object"
+
+                    color = "#%06x" % random.randint(0, 0xFFFFFF)
+
+                    annotation = {
+                        "type": "polygon",
+                        "points": points,
+                        "label": label_name,
+                        "class": "auto-detected",
+                        "stroke": color,
+                        "fill": color + "40",
+                        "left": 0,
+                        "top": 0,
+                        "width": 0,
+                        "height": 0
+                    }
+                    new_annotations.append(annotation)
+
+    return new_annotations
+
+
+def get_or_run_auto_detect(img_obj, custom_classes, conf=DEFAULT_CONF, iou=DEFAULT_IOU):
+    """
+    Returns (annotations, cached). Looks up the memoized result first and only
+    falls back to the full pipeline on a miss.
+    """
+    key = {
+        'image_hash': img_obj.compute_content_hash(),
+        'classes': ",".join(custom_classes),
+        'conf': conf,
+        'iou': iou,
+        'model_version': MODEL_VERSION,
+    }
+
+    cached = AutoDetectResult.objects.filter(**key).only('annotations').first()
+    if cached:
+        return cached.get_annotations(), True
+
+    new_annotations = run_detection_pipeline(img_obj.image.path, custom_classes, conf, iou)
+
+    try:
+        # Savepoint so a lost race doesn't poison an enclosing transaction.
+        with transaction.atomic():
+            AutoDetectResult.objects.create(annotations=json.dumps(new_annotations), **key)
+    except IntegrityError:
+        # Another request (or the warm-up worker) stored the same key first.
+        pass
+
+    return new_annotations, False
+
+
+def _warm_worker(image_id, prompt):
+    try:
+        img_obj = AnnotatedImage.objects.get(id=image_id)
+        get_or_run_auto_detect(img_obj, normalize_classes(prompt or DEFAULT_PROMPT))
+        print(f"DEBUG: Auto-detect cache warmed for image {image_id}.")
+    except Exception as e:
+        print(f"Cache Warm Error {image_id}: {e}")
+    finally:
+        connection.close()
+
+
+def warm_auto_detect_cache(image_id, prompt=None):
+    """
+    Queues auto-detect for the default project prompt on the single background
+    worker, so the first click on "Auto Detect" is already a cache hit.
+    Queued jobs hold no thread or DB connection until they run.
+    """
+    return _warm_executor.submit(_warm_worker, image_id, prompt)
@@ -0,0 +1,334 @@
+"""
+Bulk import of existing COCO / YOLO datasets into AnnotatedImage rows.
+
+Does not import views.py, so management commands can use it without loading
+the YOLO/SAM models.
+"""
+import hashlib
+import json
+import os
+import time
+
+import cv2
+import ijson
+import numpy as np
+import yaml
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+from pycocotools import mask as mask_utils
+
+from .models import AnnotatedImage
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'}
+DEFAULT_BATCH_SIZE = 500
+
+
+def polygon_entry(label, points):
+    """
+    One annotation in the layout save_all_data() stores. `points` are {'x','y'} dicts.
+    """
+    xs = [p['x'] for p in points]
+    ys = [p['y'] for p in points]
+    x, y = min(xs), min(ys)
+    return {
+        "label": label,
+        "type": "polygon",
+        "masked_image": "",
+        "coordinates": {"x": x, "y": y, "width": max(xs) - x, "height": max(ys) - y},
+        "points": points
+    }
+
+
+def saved_record(img_obj, width, height, entries):
+    return {
+        "id": img_obj.id,
+        "original_image": img_obj.image.url,
+        "original_fully_masked_image": "",
+        "imagewidth": width,
+        "imageheight": height,
+        "annotations": entries
+    }
+
+
+def store_image_file(path):
+    """
+    Copies an image into MEDIA_ROOT/images/ and returns (storage name, sha256).
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    name = default_storage.save(f"images/{os.path.basename(path)}", ContentFile(data))
+    return name, hashlib.sha256(data).hexdigest()
+
+
+def _flat_to_points(flat):
+    return [{'x': float(flat[i]), 'y': float(flat[i + 1])} for i in range(0, len(flat) - 1, 2)]
+
+
+def segmentation_to_polygons(segmentation, height, width):
+    """
+    Decodes a COCO segmentation (polygon list, RLE or uncompressed RLE) into
+    a list of point lists. Masks are traced back into outer contours.
+    """
+    if isinstance(segmentation, list):
+        return [_flat_to_points(poly) for poly in segmentation if len(poly) >= 6]
+
+    if isinstance(segmentation.get('counts'), list):
+        rle = mask_utils.frPyObjects(segmentation, height, width)
+    else:
+        rle = dict(segmentation)
+        if isinstance(rle['counts'], str):
+            rle['counts'] = rle['counts'].encode('utf-8')
+
+    binary_mask = np.ascontiguousarray(mask_utils.decode(rle), dtype=np.uint8)
+    contours, _ = cv2.findContours(binary_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    polygons = []
+    for contour in contours:
+        if len(contour) < 3: continue
+        polygons.append([{'x': float(pt[0][0]), 'y': float(pt[0][1])} for pt in contour])
+    return polygons
+
+
+def _report(stats, started):
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    stats['seconds'] = round(elapsed, 2)
+    stats['images_per_sec'] = round(stats['images'] / elapsed, 1)
+    stats['annotations_per_sec'] = round(stats['annotations'] / elapsed, 1)
+    return stats
+
+
+def merge_stats(stats_list):
+    """
+    Sums per-file import stats and recomputes the throughput over the combined run.
+    """
+    total = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            if not key.endswith('_per_sec'):
+                total[key] = total.get(key, 0) + value
+    elapsed = max(total.get('seconds', 0), 1e-6)
+    total['images_per_sec'] = round(total.get('images', 0) / elapsed, 1)
+    total['annotations_per_sec'] = round(total.get('annotations', 0) / elapsed, 1)
+    return total
+
+
+def import_coco(json_path, images_dir, batch_size=DEFAULT_BATCH_SIZE, image_lookup=None):
+    """
+    Imports a COCO instances file without loading it whole: `categories`, `images`
+    and `annotations` are each streamed with ijson in their own pass.
+    Image rows are written with bulk_create; annotations are merged in batches
+    with bulk_update. `image_lookup` (basename -> path) is a fallback for files
+    not found under `images_dir`, e.g. split folders inside an uploaded archive.
+    """
+    started = time.perf_counter()
+    stats = {'images': 0, 'annotations': 0, 'skipped': 0, 'skipped_annotations': 0}
+
+    with open(json_path, 'rb') as f:
+        categories = {c['id']: c['name'] for c in ijson.items(f, 'categories.item', use_float=True)}
+
+    # coco image id -> (db id, width, height) and db id -> (width, height);
+    # both small compared to the annotation list
+    image_index = {}
+    image_sizes = {}
+
+    def flush_images(batch):
+        created = AnnotatedImage.objects.bulk_create([obj for obj, _ in batch], batch_size=batch_size)
+        for obj, coco_img in zip(created, (c for _, c in batch)):
+            image_index[coco_img['id']] = (obj.id, coco_img.get('width'), coco_img.get('height'))
+            image_sizes[obj.id] = (coco_img.get('width'), coco_img.get('height'))
+        stats['images'] += len(created)
+
+    with open(json_path, 'rb') as f:
+        batch = []
+        for coco_img in ijson.items(f, 'images.item', use_float=True):
+            path = os.path.join(images_dir, coco_img['file_name'])
+            if not os.path.exists(path) and image_lookup:
+                path = image_lookup.get(os.path.basename(coco_img['file_name']), path)
+            if not os.path.exists(path):
+                stats['skipped'] += 1
+                continue
+
+            if not coco_img.get('width') or not coco_img.get('height'):
+                with Image.open(path) as img:
+                    coco_img['width'], coco_img['height'] = img.size
+
+            name, digest = store_image_file(path)
+            batch.append((AnnotatedImage(image=name, content_hash=digest), coco_img))
+            if len(batch) >= batch_size:
+                flush_images(batch)
+                batch = []
+        if batch:
+            flush_images(batch)
+
+    def flush_annotations(pending):
+        rows = AnnotatedImage.objects.in_bulk(list(pending))
+        for db_id, entries in pending.items():
+            obj = rows[db_id]
+            if obj.annotations:
+                record = json.loads(obj.annotations)
+                record['annotations'].extend(entries)
+            else:
+                width, height = image_sizes[db_id]
+                record = saved_record(obj, width, height, entries)
+            obj.annotations = json.dumps(record)
+        AnnotatedImage.objects.bulk_update(rows.values(), ['annotations'], batch_size=batch_size)
+
+    with open(json_path, 'rb') as f:
+        pending = {}
+        buffered = 0
+        for ann in ijson.items(f, 'annotations.item', use_float=True):
+            target = image_index.get(ann.get('image_id'))
+            if not target:
+                stats['skipped_annotations'] += 1  # image missing on disk or not listed
+                continue
+            db_id, width, height = target
+            label = str(categories.get(ann.get('category_id'), 'unknown')).lower().strip()
+
+            try:
+                polygons = segmentation_to_polygons(ann.get('segmentation') or [], height, width)
+            except Exception as e:
+                print(f"COCO Import Error (annotation {ann.get('id')}): {e}")
+                stats['skipped_annotations'] += 1
+                continue
+
+            if not polygons and ann.get('bbox'):
+                x, y, w, h = ann['bbox']
+                polygons = [_flat_to_points([x, y, x + w, y, x + w, y + h, x, y + h])]
+
+            for points in polygons:
+                pending.setdefault(db_id, []).append(polygon_entry(label, points))
+                buffered += 1
+            stats['annotations'] += len(polygons)
+
+            if buffered >= batch_size:
+                flush_annotations(pending)
+                pending, buffered = {}, 0
+        if pending:
+            flush_annotations(pending)
+
+    return _report(stats, started)
+
+
+YOLO_YAML_NAMES = ('data.yaml', 'data.yml')
+
+
+def _read_yolo_names(yaml_path):
+    with open(yaml_path) as f:
+        names = (yaml.safe_load(f) or {}).get('names', {})
+    if isinstance(names, list):
+        names = dict(enumerate(names))
+    return {int(k): str(v).lower().strip() for k, v in names.items()}
+
+
+def _yolo_names(dataset_dir):
+    """
+    Class names from data.yaml, found anywhere in the tree (zips usually wrap the
+    dataset in a top-level folder). Raises ValueError if several yaml files disagree,
+    since one id -> name map is applied to every label file.
+    """
+    found = {}
+    for root, dirs, files in os.walk(dataset_dir):
+        dirs.sort()
+        for name in YOLO_YAML_NAMES:
+            if name in files:
+                path = os.path.join(root, name)
+                found[os.path.relpath(path, dataset_dir)] = _read_yolo_names(path)
+
+    distinct = {tuple(sorted(names.items())) for names in found.values() if names}
+    if len(distinct) > 1:
+        raise ValueError(f"Conflicting class names in {', '.join(sorted(found))}")
+    return dict(distinct.pop()) if distinct else {}
+
+
+def parse_yolo_label(label_path, names, width, height):
+    """
+    Reads one YOLO label file. Handles both segmentation rows (cls x1 y1 x2 y2 ...)
+    and detection rows (cls cx cy w h); coordinates are denormalized to pixels.
+    """
+    entries = []
+    if not os.path.exists(label_path):
+        return entries
+
+    with open(label_path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5: continue
+            cls_id = int(float(parts[0]))
+            values = [float(v) for v in parts[1:]]
+            label = names.get(cls_id, str(cls_id))
+
+            if len(values) == 4:
+                cx, cy, bw, bh = values
+                values = [cx - bw / 2, cy - bh / 2, cx + bw / 2, cy - bh / 2,
+                          cx + bw / 2, cy + bh / 2, cx - bw / 2, cy + bh / 2]
+
+            points = [{'x': values[i] * width, 'y': values[i + 1] * height}
+                      for i in range(0, len(values) - 1, 2)]
+            if len(points) >= 3:
+                entries.append(polygon_entry(label, points))
+    return entries
+
+
+def iter_yolo_samples(dataset_dir):
+    """
+    Yields (image_path, label_path) for every file under an `images` directory,
+    at any depth. The label path mirrors the image path with the last `images`
+    component swapped for `labels`, as Ultralytics does, so flat exports,
+    images/train + labels/train and train/images + train/labels all resolve.
+    """
+    for root, dirs, files in os.walk(dataset_dir):
+        dirs.sort()
+        parts = os.path.relpath(root, dataset_dir).split(os.sep)
+        if 'images' not in parts:
+            continue
+
+        idx = len(parts) - 1 - parts[::-1].index('images')
+        label_root = os.path.join(dataset_dir, *parts[:idx], 'labels', *parts[idx + 1:])
+        for name in sorted(files):
+            stem = os.path.splitext(name)[0]
+            yield os.path.join(root, name), os.path.join(label_root, f"{stem}.txt")
+
+
+def import_yolo(dataset_dir, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Imports a YOLO dataset: images/ + labels/ (flat like export_yolo() writes, or split
+    into train/val subfolders) and an optional data.yaml with class names.
+    """
+    started = time.perf_counter()
+    stats = {'images': 0, 'annotations': 0, 'skipped': 0}
+    names = _yolo_names(dataset_dir)
+
+    def flush(batch):
+        created = AnnotatedImage.objects.bulk_create([obj for obj, _ in batch], batch_size=batch_size)
+        for obj, (width, height, entries) in zip(created, (meta for _, meta in batch)):
+            obj.annotations = json.dumps(saved_record(obj, width, height, entries))
+        AnnotatedImage.objects.bulk_update(created, ['annotations'], batch_size=batch_size)
+        stats['images'] += len(created)
+
+    batch = []
+    for image_path, label_path in iter_yolo_samples(dataset_dir):
+        if os.path.splitext(image_path)[1].lower() not in IMAGE_EXTENSIONS:
+            stats['skipped'] += 1
+            continue
+
+        try:
+            with Image.open(image_path) as img:
+                width, height = img.size
+            entries = parse_yolo_label(label_path, names, width, height)
+        except Exception as e:
+            print(f"YOLO Import Error {image_path}: {e}")
+            stats['skipped'] += 1
+            continue
+
+        name, digest = store_image_file(image_path)
+        batch.append((AnnotatedImage(image=name, content_hash=digest), (width, height, entries)))
+        stats['annotations'] += len(entries)
+
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    return _report(stats, started)
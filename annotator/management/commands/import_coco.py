@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from annotator.importers import DEFAULT_BATCH_SIZE, import_coco
+
+
+class Command(BaseCommand):
+    help = "Bulk-import a COCO instances json and its images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('json_path', help="Path to the COCO annotations json")
+        parser.add_argument('images_dir', help="Directory holding the files named in images[].file_name")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            stats = import_coco(options['json_path'], options['images_dir'], options['batch_size'])
+        except FileNotFoundError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['images']} images / {stats['annotations']} annotations "
+            f"in {stats['seconds']}s ({stats['images_per_sec']} img/s, "
+            f"{stats['annotations_per_sec']} ann/s), skipped {stats['skipped']} images / "
+            f"{stats['skipped_annotations']} annotations"
+        ))
@@ -0,0 +1,181 @@
+"""
+Media serving for originals, annotated_output overlays and individual_masks.
+
+Adds what django.views.static lacks for production use: strong validators
+(ETag / Last-Modified), per-folder Cache-Control, single byte-range requests,
+and optional hand-off of the transfer to the front proxy
+(X-Accel-Redirect for nginx, X-Sendfile for Apache/lighttpd).
+"""
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
+from django.views.decorators.http import require_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+# Overlays and masks are rewritten in place under the same name, so browsers must
+# revalidate them; originals get a unique name per upload and can be cached longer.
+DEFAULT_CACHE_CONTROL = {
+    'annotated_output/': 'no-cache',
+    'individual_masks/': 'no-cache',
+    'masks/': 'no-cache',
+    'exports/': 'no-cache',
+    '': 'public, max-age=86400',
+}
+
+
+def _cache_control(path):
+    rules = getattr(settings, 'MEDIA_CACHE_CONTROL', DEFAULT_CACHE_CONTROL)
+    for prefix in sorted(rules, key=len, reverse=True):
+        if path.startswith(prefix):
+            return rules[prefix]
+    return None
+
+
+def _etag(st):
+    return quote_etag(f"{int(st.st_mtime_ns):x}-{st.st_size:x}")
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags or f"W/{etag}" in etags
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def _parse_range(header, size):
+    """
+    Returns (start, end) inclusive for a single satisfiable range, None when the
+    header should be ignored, or False when it is unsatisfiable (416).
+    Multi-range requests are ignored and answered with the full body.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if first and last and int(last) < int(first):
+        return None  # syntactically invalid spec: ignore it and send the full body
+
+    if not first:
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        return False
+    return start, end
+
+
+def _iter_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _offload(path, full_path):
+    """
+    Empty response telling the proxy which file to send. The proxy then does
+    the byte transfer (and range handling) itself.
+    Both values are percent-encoded: nginx decodes X-Accel-Redirect as a URI, and
+    mod_xsendfile unescapes X-Sendfile by default (XSendFileUnescape On).
+    """
+    accel_prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', None)
+    if accel_prefix:
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(path)
+        return response
+
+    sendfile_header = getattr(settings, 'MEDIA_SENDFILE_HEADER', None)
+    if sendfile_header:
+        response = HttpResponse()
+        response[sendfile_header] = quote(full_path, safe='/\\:')
+        return response
+
+    return None
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Invalid path")
+
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        raise Http404("File not found")
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404("File not found")
+
+    etag = _etag(st)
+    last_modified = http_date(st.st_mtime)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    def finish(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        cache_control = _cache_control(path)
+        if cache_control:
+            response['Cache-Control'] = cache_control
+        return response
+
+    if _not_modified(request, etag, st.st_mtime):
+        return finish(HttpResponseNotModified())
+
+    offloaded = _offload(path, full_path)
+    if offloaded is not None:
+        offloaded['Content-Type'] = content_type
+        return finish(offloaded)
+
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and if_range and if_range not in (etag, last_modified):
+        range_header = None  # resource changed since the client's partial copy
+
+    byte_range = _parse_range(range_header, st.st_size) if range_header else None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{st.st_size}"
+        return finish(response)
+
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(_iter_range(full_path, start, length), status=206, content_type=content_type)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f"bytes {start}-{end}/{st.st_size}"
+    else:
+        # FileResponse uses wsgi.file_wrapper (sendfile) when the server offers it.
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(st.st_size)
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Accept-Ranges'] = 'bytes'
+    return finish(response)
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotator", "0002_annotatedimage_annotated_file_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="annotatedimage",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, default="", max_length=64),
+        ),
+        migrations.CreateModel(
+            name="AutoDetectResult",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("image_hash", models.CharField(max_length=64)),
+                ("classes", models.TextField()),
+                ("conf", models.FloatField()),
+                ("iou", models.FloatField()),
+                ("model_version", models.CharField(max_length=128)),
+                ("annotations", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("image_hash", "classes", "conf", "iou", "model_version"),
+                        name="unique_auto_detect_key",
+                    )
+                ],
+            },
+        ),
+    ]
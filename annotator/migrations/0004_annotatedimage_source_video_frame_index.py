@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("annotator", "0003_annotatedimage_content_hash_autodetectresult"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="annotatedimage",
+            name="source_video",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="annotatedimage",
+            name="frame_index",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
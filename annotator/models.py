@@ -1,4 +1,5 @@
 from django.db import models
+import hashlib
 import json
 
 class AnnotatedImage(models.Model):
@@ -7,6 +8,9 @@ class AnnotatedImage(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     mask_file = models.ImageField(upload_to='masks/', blank=True, null=True)
     annotated_file = models.ImageField(upload_to='annotated_output/', blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    source_video = models.CharField(max_length=255, blank=True, default='')
+    frame_index = models.IntegerField(blank=True, null=True)
 
     def __str__(self):
         return self.image.name
@@ -20,4 +24,80 @@ class AnnotatedImage(models.Model):
     def get_annotations(self):
         if self.annotations:
             return json.loads(self.annotations)
-        return []
\ No newline at end of file
+        return []
+
+    def compute_content_hash(self):
+        """
+        SHA-256 of the stored image bytes. Cached on the row so repeat lookups
+        (e.g. the auto-detect cache) don't re-read the file.
+        """
+        if self.content_hash:
+            return self.content_hash
+
+        digest = hashlib.sha256()
+        self.image.open('rb')
+        try:
+            for chunk in self.image.chunks():
+                digest.update(chunk)
+        finally:
+            self.image.close()
+
+        self.content_hash = digest.hexdigest()
+        if self.pk:
+            AnnotatedImage.objects.filter(pk=self.pk).update(content_hash=self.content_hash)
+        return self.content_hash
+
+
+class AutoDetectResult(models.Model):
+    """
+    Memoized output of the YOLO-World + SAM pipeline.
+    Keyed on image content (not row id) so re-uploads of the same file hit too.
+    """
+    image_hash = models.CharField(max_length=64)
+    classes = models.TextField()  # normalized, comma-joined class list
+    conf = models.FloatField()
+    iou = models.FloatField()
+    model_version = models.CharField(max_length=128)
+    annotations = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['image_hash', 'classes', 'conf', 'iou', 'model_version'],
+                name='unique_auto_detect_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"AutoDetect {self.image_hash[:12]} [{self.classes}]"
+
+    def get_annotations(self):
+        return json.loads(self.annotations)
+
+
+class VideoIngestJob(models.Model):
+    """
+    Progress of one uploaded clip being ingested on the background worker.
+    `stats` mirrors ingest_video()'s counters (frames, keyframes, first/last_image_id).
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    video_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    stats = models.TextField(blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Video ingest {self.id} ({self.status})"
+
+    def get_stats(self):
+        if self.stats:
+            return json.loads(self.stats)
+        return {}
@@ -0,0 +1,138 @@
+"""
+Mask rasterization for the segmentation exporters.
+
+Kept free of Django models and the YOLO/SAM globals in views.py so that
+process-pool workers can import it without loading the AI models.
+"""
+import io
+import os
+import xml.etree.ElementTree as ET
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def _to_int_polygon(points):
+    pts = [[p['x'], p['y']] if isinstance(p, dict) else [p[0], p[1]] for p in points]
+    return np.round(np.array(pts, dtype=np.float64)).astype(np.int32).reshape(-1, 1, 2)
+
+
+def _encode_png(array):
+    ok, buf = cv2.imencode('.png', array)
+    if not ok:
+        raise ValueError("PNG encoding failed")
+    return buf.tobytes()
+
+
+def build_voc_xml(file_name, width, height, objects):
+    """
+    Pascal VOC annotation XML. `objects` is a list of (label, [xmin, ymin, xmax, ymax]).
+    """
+    root = ET.Element('annotation')
+    ET.SubElement(root, 'folder').text = 'JPEGImages'
+    ET.SubElement(root, 'filename').text = file_name
+
+    size = ET.SubElement(root, 'size')
+    ET.SubElement(size, 'width').text = str(width)
+    ET.SubElement(size, 'height').text = str(height)
+    ET.SubElement(size, 'depth').text = '3'
+    ET.SubElement(root, 'segmented').text = '1'
+
+    for label, (xmin, ymin, xmax, ymax) in objects:
+        obj = ET.SubElement(root, 'object')
+        ET.SubElement(obj, 'name').text = label
+        ET.SubElement(obj, 'pose').text = 'Unspecified'
+        ET.SubElement(obj, 'truncated').text = '0'
+        ET.SubElement(obj, 'difficult').text = '0'
+        bndbox = ET.SubElement(obj, 'bndbox')
+        ET.SubElement(bndbox, 'xmin').text = str(xmin)
+        ET.SubElement(bndbox, 'ymin').text = str(ymin)
+        ET.SubElement(bndbox, 'xmax').text = str(xmax)
+        ET.SubElement(bndbox, 'ymax').text = str(ymax)
+
+    ET.indent(root)
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+def render_image_masks(job):
+    """
+    Process-pool worker. Rasterizes one image's polygons into:
+      - a class map (pixel value = class id, 0 = background)
+      - an instance map (pixel value = 1-based instance index, uint16)
+      - a VOC XML annotation
+    Later polygons paint over earlier ones, matching the canvas stacking order.
+    Never raises: a bad image comes back as {'stem', 'error'} so callers can skip it.
+    """
+    try:
+        return _render_image_masks(job)
+    except Exception as e:
+        return {'stem': job.get('stem'), 'error': str(e)}
+
+
+def _render_image_masks(job):
+    stem = job['stem']
+    width, height = job['width'], job['height']
+    if not width or not height:
+        with Image.open(job['image_path']) as img:
+            width, height = img.size
+    width, height = int(width), int(height)
+
+    class_dtype = np.uint8 if job['num_classes'] < 256 else np.uint16
+    class_map = np.zeros((height, width), dtype=class_dtype)
+    instance_map = np.zeros((height, width), dtype=np.uint16)
+    objects = []
+
+    for instance_id, (label, cls_id, points) in enumerate(job['shapes'], start=1):
+        poly = _to_int_polygon(points)
+        cv2.fillPoly(class_map, [poly], int(cls_id))
+        cv2.fillPoly(instance_map, [poly], instance_id)
+
+        xs, ys = poly[:, 0, 0], poly[:, 0, 1]
+        objects.append((label, [
+            int(max(0, xs.min())), int(max(0, ys.min())),
+            int(min(width - 1, xs.max())), int(min(height - 1, ys.max())),
+        ]))
+
+    return {
+        'stem': stem,
+        'width': width,
+        'height': height,
+        'class_png': _encode_png(class_map),
+        'instance_png': _encode_png(instance_map),
+        'voc_xml': build_voc_xml(job['file_name'], width, height, objects),
+    }
+
+
+class ZipStreamBuffer(io.RawIOBase):
+    """
+    Write-only sink for zipfile that lets a generator hand out the bytes
+    written so far, so the archive can be streamed without building it in memory.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def mask_export_workers():
+    return max(1, min(8, (os.cpu_count() or 2) - 1))
@@ -0,0 +1,174 @@
+"""
+Sharded, training-ready dataset export.
+
+Writes fixed-size shards either as WebDataset tars (key.jpg / key.json /
+key.mask.png / key.inst.png per sample) or as Parquet files (one row per sample,
+image and masks as binary columns). Like rendering.py this module stays free of
+the YOLO/SAM globals so shards can be written in worker processes.
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+
+from .rendering import render_image_masks
+
+SHARD_FORMATS = ('tar', 'parquet')
+
+
+def sample_key(job):
+    return f"{job['id']:08d}"
+
+
+def sample_annotations(job, result):
+    return {
+        "key": sample_key(job),
+        "file_name": job['file_name'],
+        "width": result['width'],
+        "height": result['height'],
+        "annotations": [
+            {
+                "label": label,
+                "class_id": cls_id,
+                "points": [[p['x'], p['y']] if isinstance(p, dict) else [p[0], p[1]] for p in points],
+            }
+            for label, cls_id, points in job['shapes']
+        ],
+    }
+
+
+def _add_tar_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 0  # keep shards byte-identical across re-exports of unchanged data
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _iter_samples(jobs, failed):
+    """
+    Renders each job and reads its image, yielding (job, result, image_bytes).
+    A sample that fails is logged, appended to `failed` and left out of the shard.
+    """
+    for job in jobs:
+        result = render_image_masks(job)
+        if 'error' in result:
+            print(f"Shard Export Error {job['id']}: {result['error']}")
+            failed.append(job['id'])
+            continue
+        try:
+            with open(job['image_path'], 'rb') as f:
+                image_bytes = f.read()
+        except OSError as e:
+            print(f"Shard Export Error {job['id']}: {e}")
+            failed.append(job['id'])
+            continue
+        yield job, result, image_bytes
+
+
+def _write_tar(path, jobs, failed):
+    with tarfile.open(path, 'w') as tar:
+        for job, result, image_bytes in _iter_samples(jobs, failed):
+            key = sample_key(job)
+            ext = os.path.splitext(job['file_name'])[1].lower().lstrip('.') or 'jpg'
+            _add_tar_member(tar, f"{key}.{ext}", image_bytes)
+            _add_tar_member(tar, f"{key}.json", json.dumps(sample_annotations(job, result)).encode('utf-8'))
+            _add_tar_member(tar, f"{key}.mask.png", result['class_png'])
+            _add_tar_member(tar, f"{key}.inst.png", result['instance_png'])
+
+
+PARQUET_ROW_GROUP_SIZE = 64
+
+
+def _write_parquet(path, jobs, failed):
+    """
+    Writes row groups of PARQUET_ROW_GROUP_SIZE samples as they are rendered,
+    so a worker never holds a whole shard of images in memory.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('key', pa.string()),
+        ('file_name', pa.string()),
+        ('width', pa.int32()),
+        ('height', pa.int32()),
+        ('image', pa.binary()),
+        ('mask', pa.binary()),
+        ('instance_mask', pa.binary()),
+        ('labels', pa.list_(pa.string())),
+        ('class_ids', pa.list_(pa.int32())),
+        ('polygons', pa.string()),
+    ])
+
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        rows = []
+        for job, result, image_bytes in _iter_samples(jobs, failed):
+            meta = sample_annotations(job, result)
+            rows.append({
+                'key': meta['key'],
+                'file_name': meta['file_name'],
+                'width': meta['width'],
+                'height': meta['height'],
+                'image': image_bytes,
+                'mask': result['class_png'],
+                'instance_mask': result['instance_png'],
+                'labels': [a['label'] for a in meta['annotations']],
+                'class_ids': [a['class_id'] for a in meta['annotations']],
+                'polygons': json.dumps([a['points'] for a in meta['annotations']]),
+            })
+            if len(rows) >= PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                rows = []
+        if rows:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_shard(task):
+    """
+    Process-pool worker: renders and writes one shard, returning its manifest entry.
+    The file is written under a temp name and swapped in, so readers never see a partial shard.
+    """
+    fmt, out_dir, index, jobs = task['format'], task['out_dir'], task['index'], task['jobs']
+    name = f"shard-{index:06d}.{fmt}"
+    path = os.path.join(out_dir, name)
+    tmp_path = path + '.tmp'
+    failed = []
+
+    if fmt == 'parquet':
+        _write_parquet(tmp_path, jobs, failed)
+    else:
+        _write_tar(tmp_path, jobs, failed)
+    os.replace(tmp_path, path)
+
+    return {
+        'index': index,
+        'name': name,
+        'samples': len(jobs) - len(failed),
+        'bytes': os.path.getsize(path),
+        'sha256': _sha256(path),
+        # Shard membership is recorded so a single-shard rebuild uses the same samples.
+        'image_ids': [job['id'] for job in jobs],
+        'failed_image_ids': failed,
+    }
+
+
+def split_into_shards(jobs, samples_per_shard):
+    return [jobs[i:i + samples_per_shard] for i in range(0, len(jobs), samples_per_shard)]
+
+
+def remove_stale_shards(out_dir, keep_names):
+    """
+    Deletes shard files (and leftover temp files) not produced by the latest full export.
+    """
+    for name in os.listdir(out_dir):
+        if name.startswith('shard-') and name not in keep_names:
+            os.remove(os.path.join(out_dir, name))
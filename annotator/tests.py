@@ -1,3 +1,646 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import cv2
+import numpy as np
+import yaml
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils.http import http_date
+from pycocotools import mask as mask_utils
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+from . import views
+from .autodetect import MODEL_VERSION, get_or_run_auto_detect, normalize_classes, parse_threshold
+from .media import _not_modified, _parse_range
+from .models import AnnotatedImage, AutoDetectResult, VideoIngestJob
+from .rendering import render_image_masks
+from .sharding import split_into_shards, write_shard
+from .video import KeyframeTracker, iter_video_frames, propagate_polygons
+from .importers import _yolo_names, import_yolo, iter_yolo_samples, merge_stats, parse_yolo_label, segmentation_to_polygons
+
+
+def _bounds(points):
+    xs = [p['x'] for p in points]
+    ys = [p['y'] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+class SegmentationToPolygonsTests(SimpleTestCase):
+
+    def test_polygon_list(self):
+        polygons = segmentation_to_polygons([[0, 0, 10, 0, 10, 5], [1, 2]], 20, 20)
+        self.assertEqual(len(polygons), 1)  # the 1-point polygon is dropped
+        self.assertEqual(polygons[0], [{'x': 0.0, 'y': 0.0}, {'x': 10.0, 'y': 0.0}, {'x': 10.0, 'y': 5.0}])
+
+    def test_compressed_rle(self):
+        mask = np.zeros((10, 12), dtype=np.uint8)
+        mask[2:7, 3:9] = 1
+        rle = mask_utils.encode(np.asfortranarray(mask))
+        rle['counts'] = rle['counts'].decode('utf-8')  # as stored in COCO json
+
+        polygons = segmentation_to_polygons(rle, 10, 12)
+        self.assertEqual(len(polygons), 1)
+        self.assertEqual(_bounds(polygons[0]), (3.0, 2.0, 8.0, 6.0))
+
+    def test_uncompressed_rle(self):
+        # 4x4 mask with a 2x2 block at rows 1-2, cols 1-2 (column-major runs)
+        rle = {'size': [4, 4], 'counts': [5, 2, 2, 2, 5]}
+
+        polygons = segmentation_to_polygons(rle, 4, 4)
+        self.assertEqual(len(polygons), 1)
+        self.assertEqual(_bounds(polygons[0]), (1.0, 1.0, 2.0, 2.0))
+
+
+class ParseYoloLabelTests(SimpleTestCase):
+
+    def _label_file(self, content):
+        fd, path = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_segmentation_row(self):
+        path = self._label_file("0 0.1 0.2 0.5 0.2 0.5 0.8\n")
+        entries = parse_yolo_label(path, {0: 'car'}, 100, 50)
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['label'], 'car')
+        self.assertEqual(entries[0]['type'], 'polygon')
+        self.assertEqual(
+            [(round(p['x'], 6), round(p['y'], 6)) for p in entries[0]['points']],
+            [(10.0, 10.0), (50.0, 10.0), (50.0, 40.0)],
+        )
+
+    def test_bbox_row(self):
+        path = self._label_file("3 0.5 0.5 0.2 0.4\n")
+        entries = parse_yolo_label(path, {}, 100, 50)
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['label'], '3')  # unnamed classes fall back to the id
+        coords = entries[0]['coordinates']
+        self.assertAlmostEqual(coords['x'], 40.0)
+        self.assertAlmostEqual(coords['y'], 15.0)
+        self.assertAlmostEqual(coords['width'], 20.0)
+        self.assertAlmostEqual(coords['height'], 20.0)
+
+    def test_short_rows_and_missing_file(self):
+        path = self._label_file("0 0.1 0.2\n\n")
+        self.assertEqual(parse_yolo_label(path, {}, 100, 50), [])
+        self.assertEqual(parse_yolo_label(path + '.missing', {}, 100, 50), [])
+
+
+class IterYoloSamplesTests(SimpleTestCase):
+
+    def test_split_layout_maps_to_mirrored_labels(self):
+        with tempfile.TemporaryDirectory() as root:
+            for split in ('train', 'val'):
+                os.makedirs(os.path.join(root, 'images', split))
+                open(os.path.join(root, 'images', split, f'{split}_1.jpg'), 'wb').close()
+
+            samples = list(iter_yolo_samples(root))
+
+        self.assertEqual(samples, [
+            (os.path.join(root, 'images', 'train', 'train_1.jpg'), os.path.join(root, 'labels', 'train', 'train_1.txt')),
+            (os.path.join(root, 'images', 'val', 'val_1.jpg'), os.path.join(root, 'labels', 'val', 'val_1.txt')),
+        ])
+
+
+
+def write_nested_yolo_dataset(root, names):
+    """
+    The layout of a zipped Ultralytics dataset: everything under one top-level folder.
+    """
+    ds = os.path.join(root, 'ds')
+    for sub in ('train/images', 'train/labels'):
+        os.makedirs(os.path.join(ds, sub))
+    with open(os.path.join(ds, 'data.yaml'), 'w') as f:
+        yaml.safe_dump({'train': 'train/images', 'names': names}, f)
+    cv2.imwrite(os.path.join(ds, 'train', 'images', 'a.jpg'), np.zeros((10, 20, 3), dtype=np.uint8))
+    with open(os.path.join(ds, 'train', 'labels', 'a.txt'), 'w') as f:
+        f.write("0 0.1 0.1 0.9 0.1 0.9 0.9\n")
+
+
+class YoloNamesTests(SimpleTestCase):
+
+    def test_nested_data_yaml(self):
+        with tempfile.TemporaryDirectory() as root:
+            write_nested_yolo_dataset(root, ['Cat'])
+            self.assertEqual(_yolo_names(root), {0: 'cat'})
+
+    def test_matching_yaml_files_are_fine(self):
+        with tempfile.TemporaryDirectory() as root:
+            write_nested_yolo_dataset(root, ['cat'])
+            with open(os.path.join(root, 'data.yaml'), 'w') as f:
+                yaml.safe_dump({'names': {0: 'cat'}}, f)
+            self.assertEqual(_yolo_names(root), {0: 'cat'})
+
+    def test_conflicting_yaml_files_are_rejected(self):
+        with tempfile.TemporaryDirectory() as root:
+            write_nested_yolo_dataset(root, ['cat'])
+            with open(os.path.join(root, 'data.yaml'), 'w') as f:
+                yaml.safe_dump({'names': ['dog']}, f)
+            with self.assertRaises(ValueError):
+                _yolo_names(root)
+
+    def test_no_yaml(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.assertEqual(_yolo_names(root), {})
+
+class MergeStatsTests(SimpleTestCase):
+
+    def test_sums_counts_and_recomputes_rates(self):
+        total = merge_stats([
+            {'images': 10, 'annotations': 30, 'skipped': 1, 'seconds': 1.0, 'images_per_sec': 10.0},
+            {'images': 30, 'annotations': 10, 'skipped': 0, 'seconds': 3.0, 'images_per_sec': 10.0},
+        ])
+        self.assertEqual(total['images'], 40)
+        self.assertEqual(total['skipped'], 1)
+        self.assertEqual(total['images_per_sec'], 10.0)
+        self.assertEqual(total['annotations_per_sec'], 10.0)
+
+
+class ParseRangeTests(SimpleTestCase):
+
+    def test_satisfiable_ranges(self):
+        self.assertEqual(_parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(_parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(_parse_range('bytes=90-200', 100), (90, 99))  # end clamped to size
+        self.assertEqual(_parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(_parse_range('bytes=-500', 100), (0, 99))
+
+    def test_unsatisfiable_ranges(self):
+        self.assertIs(_parse_range('bytes=100-', 100), False)
+        self.assertIs(_parse_range('bytes=-0', 100), False)
+        self.assertIs(_parse_range('bytes=-5', 0), False)
+        self.assertIs(_parse_range('bytes=0-', 0), False)
+
+    def test_ignored_ranges(self):
+        self.assertIsNone(_parse_range('bytes=5-2', 100))  # invalid spec, answer 200
+        self.assertIsNone(_parse_range('bytes=0-1,5-6', 100))  # multi-range not supported
+        self.assertIsNone(_parse_range('bytes=-', 100))
+        self.assertIsNone(_parse_range('items=0-9', 100))
+
+
+class NotModifiedTests(SimpleTestCase):
+    etag = '"abc-10"'
+    mtime = 1_700_000_000
+
+    def _request(self, **headers):
+        return RequestFactory().get('/media/images/a.jpg', **headers)
+
+    def test_etag_match(self):
+        self.assertTrue(_not_modified(self._request(HTTP_IF_NONE_MATCH=self.etag), self.etag, self.mtime))
+        self.assertTrue(_not_modified(self._request(HTTP_IF_NONE_MATCH=f'"x", W/{self.etag}'), self.etag, self.mtime))
+        self.assertTrue(_not_modified(self._request(HTTP_IF_NONE_MATCH='*'), self.etag, self.mtime))
+        self.assertFalse(_not_modified(self._request(HTTP_IF_NONE_MATCH='"other"'), self.etag, self.mtime))
+
+    def test_if_modified_since(self):
+        self.assertTrue(_not_modified(self._request(HTTP_IF_MODIFIED_SINCE=http_date(self.mtime)), self.etag, self.mtime))
+        self.assertFalse(_not_modified(self._request(HTTP_IF_MODIFIED_SINCE=http_date(self.mtime - 60)), self.etag, self.mtime))
+        self.assertFalse(_not_modified(self._request(HTTP_IF_MODIFIED_SINCE='garbage'), self.etag, self.mtime))
+        self.assertFalse(_not_modified(self._request(), self.etag, self.mtime))
+
+    def test_if_none_match_takes_precedence(self):
+        request = self._request(HTTP_IF_NONE_MATCH='"other"', HTTP_IF_MODIFIED_SINCE=http_date(self.mtime))
+        self.assertFalse(_not_modified(request, self.etag, self.mtime))
+
+
+class RenderImageMasksTests(SimpleTestCase):
+
+    def _job(self, **overrides):
+        job = {
+            'stem': 'img_1',
+            'file_name': 'img_1.jpg',
+            'image_path': '/nonexistent/img_1.jpg',
+            'width': 20,
+            'height': 10,
+            'num_classes': 3,
+            'shapes': [
+                ('car', 1, [{'x': 0, 'y': 0}, {'x': 9, 'y': 0}, {'x': 9, 'y': 9}, {'x': 0, 'y': 9}]),
+                ('tree', 2, [[5, 0], [14, 0], [14, 9], [5, 9]]),
+            ],
+        }
+        job.update(overrides)
+        return job
+
+    def _decode(self, png):
+        return cv2.imdecode(np.frombuffer(png, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+    def test_class_and_instance_maps(self):
+        result = render_image_masks(self._job())
+        class_map = self._decode(result['class_png'])
+        instance_map = self._decode(result['instance_png'])
+
+        self.assertEqual(class_map.shape, (10, 20))
+        self.assertEqual(class_map.dtype, np.uint8)
+        self.assertEqual(instance_map.dtype, np.uint16)
+        self.assertEqual(class_map[5, 2], 1)
+        self.assertEqual(class_map[5, 7], 2)  # later polygon paints over the overlap
+        self.assertEqual(class_map[5, 17], 0)
+        self.assertEqual(instance_map[5, 2], 1)
+        self.assertEqual(instance_map[5, 12], 2)
+
+    def test_voc_xml(self):
+        xml = render_image_masks(self._job())['voc_xml'].decode('utf-8')
+        self.assertIn('<filename>img_1.jpg</filename>', xml)
+        self.assertIn('<name>car</name>', xml)
+        self.assertIn('<name>tree</name>', xml)
+        self.assertIn('<xmax>14</xmax>', xml)
+
+    def test_failure_returns_error_marker(self):
+        # No stored size forces a read of the (missing) image.
+        result = render_image_masks(self._job(width=None, height=None))
+        self.assertEqual(result['stem'], 'img_1')
+        self.assertIn('error', result)
+
+
+class NormalizeClassesTests(SimpleTestCase):
+
+    def test_equivalent_prompts_share_a_key(self):
+        expected = ['car', 'person', 'tree']
+        self.assertEqual(normalize_classes("car, person, tree"), expected)
+        self.assertEqual(normalize_classes("  Tree,CAR ,person"), expected)
+        self.assertEqual(normalize_classes("person, car, car, tree, , "), expected)
+
+    def test_empty_prompt(self):
+        self.assertEqual(normalize_classes(" , ,"), [])
+
+
+class ParseThresholdTests(SimpleTestCase):
+
+    def _parse(self, query):
+        return parse_threshold(RequestFactory().get('/auto-detect/1/', query), 'conf', 0.15)
+
+    def test_default_and_valid_values(self):
+        self.assertEqual(self._parse({}), (0.15, None))
+        self.assertEqual(self._parse({'conf': '0.3'}), (0.3, None))
+        self.assertEqual(self._parse({'conf': '1'}), (1.0, None))
+
+    def test_invalid_values(self):
+        for raw in ('abc', '', '-0.1', '1.5'):
+            value, error = self._parse({'conf': raw})
+            self.assertIsNone(value)
+            self.assertIn("'conf'", error)
+
+
+AUTO_DETECT_RESULT = [{'type': 'polygon', 'label': 'car', 'points': [{'x': 0, 'y': 0}, {'x': 4, 'y': 0}, {'x': 4, 'y': 4}]}]
+
+
+class AutoDetectCacheTests(TestCase):
+
+    def setUp(self):
+        # content_hash is preset so no image file has to exist on disk
+        self.img = AnnotatedImage.objects.create(image='images/a.jpg', content_hash='a' * 64)
+
+    @mock.patch('annotator.autodetect.run_detection_pipeline', return_value=AUTO_DETECT_RESULT)
+    def test_miss_then_hit_runs_pipeline_once(self, pipeline):
+        first, cached_first = get_or_run_auto_detect(self.img, ['car', 'tree'])
+        second, cached_second = get_or_run_auto_detect(self.img, normalize_classes("Tree, car"))
+
+        self.assertEqual(pipeline.call_count, 1)
+        self.assertFalse(cached_first)
+        self.assertTrue(cached_second)
+        self.assertEqual(first, AUTO_DETECT_RESULT)
+        self.assertEqual(second, AUTO_DETECT_RESULT)
+        self.assertEqual(AutoDetectResult.objects.count(), 1)
+
+    @mock.patch('annotator.autodetect.run_detection_pipeline', return_value=AUTO_DETECT_RESULT)
+    def test_thresholds_are_part_of_the_key(self, pipeline):
+        get_or_run_auto_detect(self.img, ['car'], conf=0.15)
+        get_or_run_auto_detect(self.img, ['car'], conf=0.3)
+        self.assertEqual(pipeline.call_count, 2)
+
+    def test_lost_race_keeps_result_and_transaction_usable(self):
+        def pipeline(image_path, classes, conf, iou):
+            # Another worker stores the same key while this one is still running.
+            AutoDetectResult.objects.create(
+                image_hash=self.img.content_hash, classes=",".join(classes), conf=conf, iou=iou,
+                model_version=MODEL_VERSION, annotations=json.dumps([]),
+            )
+            return AUTO_DETECT_RESULT
+
+        with mock.patch('annotator.autodetect.run_detection_pipeline', side_effect=pipeline):
+            annotations, cached = get_or_run_auto_detect(self.img, ['car'])
+
+        self.assertEqual(annotations, AUTO_DETECT_RESULT)
+        self.assertFalse(cached)
+        self.assertEqual(AutoDetectResult.objects.count(), 1)  # the DB is still queryable
+
+    @mock.patch('annotator.autodetect.run_detection_pipeline')
+    def test_view_rejects_bad_thresholds(self, pipeline):
+        for query in ({'conf': 'abc'}, {'iou': '2'}):
+            request = RequestFactory().get(f'/auto-detect/{self.img.id}/', query)
+            response = views.auto_detect(request, self.img.id)
+            self.assertEqual(response.status_code, 400)
+        pipeline.assert_not_called()
+
+
+class IterVideoFramesTests(SimpleTestCase):
+    # Flat gray frames: 0-3 identical, 4-7 all different.
+    LEVELS = [100, 100, 100, 100, 0, 50, 150, 200]
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.avi')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+        writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+        if not writer.isOpened():
+            self.skipTest("no MJPG encoder in this OpenCV build")
+        for level in self.LEVELS:
+            writer.write(np.full((48, 64, 3), level, dtype=np.uint8))
+        writer.release()
+
+    def _indices(self, **kwargs):
+        return [idx for idx, _ in iter_video_frames(self.path, **kwargs)]
+
+    def test_stride(self):
+        self.assertEqual(self._indices(), list(range(8)))
+        self.assertEqual(self._indices(stride=3), [0, 3, 6])
+
+    def test_dedup_skips_near_identical_frames(self):
+        self.assertEqual(self._indices(dedup_threshold=2.0), [0, 4, 5, 6, 7])
+        self.assertEqual(self._indices(stride=2, dedup_threshold=2.0), [0, 4, 6])
+
+    def test_unreadable_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a video')
+        with self.assertRaises(ValueError):
+            list(iter_video_frames(self.path))
+
+
+class PropagatePolygonsTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.prev = cv2.GaussianBlur(rng.integers(0, 256, (120, 160), dtype=np.uint8), (5, 5), 0)
+        self.shifted = np.roll(self.prev, (3, 5), axis=(0, 1))  # 5px right, 3px down
+
+    def test_follows_translation(self):
+        square = [{'x': 50, 'y': 40}, {'x': 90, 'y': 40}, {'x': 90, 'y': 80}, {'x': 50, 'y': 80}]
+        result = propagate_polygons(self.prev, self.shifted, [{'label': 'car', 'points': square}])
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['label'], 'car')
+        self.assertEqual(result[0]['class'], 'propagated')
+        for before, after in zip(square, result[0]['points']):
+            self.assertAlmostEqual(after['x'], before['x'] + 5, delta=0.5)
+            self.assertAlmostEqual(after['y'], before['y'] + 3, delta=0.5)
+
+    def test_degenerate_polygons_are_dropped(self):
+        line = [{'x': 50, 'y': 40}, {'x': 90, 'y': 40}]
+        self.assertEqual(propagate_polygons(self.prev, self.shifted, [{'label': 'car', 'points': line}]), [])
+
+
+class KeyframeTrackerTests(SimpleTestCase):
+    POLYGON = [{'label': 'car', 'points': [{'x': 0, 'y': 0}, {'x': 4, 'y': 0}, {'x': 4, 'y': 4}]}]
+
+    def _run(self, frames, detected, propagated, keyframe_every=3):
+        tracker = KeyframeTracker(keyframe_every)
+        gray = np.zeros((8, 8), dtype=np.uint8)
+        with mock.patch('annotator.video.propagate_polygons', side_effect=propagated) as propagate:
+            schedule = [tracker.step(gray, lambda: detected)[1] for _ in range(frames)]
+        return schedule, propagate
+
+    def test_keyframe_every_n_frames(self):
+        schedule, propagate = self._run(7, self.POLYGON, lambda prev, gray, anns: anns)
+        self.assertEqual(schedule, [True, False, False, True, False, False, True])
+        self.assertEqual(propagate.call_count, 4)
+
+    def test_empty_keyframe_stays_empty(self):
+        # Nothing detected: no early re-detect and nothing to propagate.
+        schedule, propagate = self._run(7, [], lambda prev, gray, anns: anns)
+        self.assertEqual(schedule, [True, False, False, True, False, False, True])
+        propagate.assert_not_called()
+
+    def test_lost_tracking_forces_early_keyframe(self):
+        results = iter([self.POLYGON, [], self.POLYGON, self.POLYGON, self.POLYGON])
+        schedule, _ = self._run(6, self.POLYGON, lambda prev, gray, anns: next(results))
+        self.assertEqual(schedule, [True, False, True, False, False, True])
+
+
+class UploadVideoTests(TestCase):
+
+    @mock.patch('annotator.views.submit_ingest_job')
+    def test_queues_job_and_returns_id(self, submit):
+        upload = SimpleUploadedFile('clip.mp4', b'fake video bytes', content_type='video/mp4')
+        request = RequestFactory().post('/upload-video/', {'video': upload, 'stride': '5'})
+        response = views.upload_video(request)
+
+        self.assertEqual(response.status_code, 202)
+        job = VideoIngestJob.objects.get(id=json.loads(response.content)['job_id'])
+        self.assertEqual(job.status, VideoIngestJob.PENDING)
+
+        _, video_path, classes, stride, _, _ = submit.call_args[0]
+        self.addCleanup(os.remove, video_path)
+        with open(video_path, 'rb') as f:
+            self.assertEqual(f.read(), b'fake video bytes')  # the worker gets its own copy
+        self.assertEqual(stride, 5)
+
+        status = json.loads(views.video_ingest_status(RequestFactory().get('/'), job.id).content)
+        self.assertEqual(status['status'], 'pending')
+
+    @mock.patch('annotator.views.submit_ingest_job')
+    def test_rejects_bad_params(self, submit):
+        upload = SimpleUploadedFile('clip.mp4', b'x')
+        response = views.upload_video(RequestFactory().post('/upload-video/', {'video': upload, 'stride': 'ten'}))
+        self.assertEqual(response.status_code, 400)
+        submit.assert_not_called()
+
+
+TRIANGLE = [{'x': 0, 'y': 0}, {'x': 4, 'y': 0}, {'x': 4, 'y': 4}]
+
+
+class MediaRootTestCase(TestCase):
+    """
+    Points MEDIA_ROOT at a temp dir so image rows can have real files behind them.
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def make_image(self, name, annotations, size=(8, 8)):
+        os.makedirs(os.path.join(self.media_root, 'images'), exist_ok=True)
+        cv2.imwrite(os.path.join(self.media_root, 'images', name), np.zeros((size[1], size[0], 3), dtype=np.uint8))
+        record = {'imagewidth': size[0], 'imageheight': size[1], 'annotations': annotations}
+        return AnnotatedImage.objects.create(image=f'images/{name}', annotations=json.dumps(record))
+
+
+class CollectMaskJobsTests(MediaRootTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # A rect/circle saved without points must still take its class id.
+        self.make_image('a.jpg', [{'label': 'Box', 'type': 'rect', 'points': []}, {'label': 'car', 'points': TRIANGLE}])
+
+    def test_labels_without_polygons_keep_their_id(self):
+        jobs, class_map = views.collect_mask_jobs()
+        self.assertEqual(class_map, {'box': 1, 'car': 2})
+        self.assertEqual(jobs[0]['shapes'], [('car', 2, TRIANGLE)])
+        self.assertEqual(jobs[0]['num_classes'], 3)
+
+    def test_ids_match_yolo_export(self):
+        response = views.export_yolo(RequestFactory().get('/export/yolo/'))
+        with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+            yolo_names = yaml.safe_load(zf.read('data.yaml'))['names']
+        _, class_map = views.collect_mask_jobs()
+        self.assertEqual({cls_id + 1: name for cls_id, name in yolo_names.items()}, {v: k for k, v in class_map.items()})
+
+
+class ImportYoloTests(MediaRootTestCase):
+
+    def test_nested_dataset_keeps_class_names(self):
+        with tempfile.TemporaryDirectory() as root:
+            write_nested_yolo_dataset(root, ['cat'])
+            stats = import_yolo(root)
+
+        self.assertEqual(stats['images'], 1)
+        record = AnnotatedImage.objects.get().get_annotations()
+        self.assertEqual([ann['label'] for ann in record['annotations']], ['cat'])
+
+
+class SplitIntoShardsTests(SimpleTestCase):
+
+    def test_fixed_size_with_short_tail(self):
+        self.assertEqual(split_into_shards(list(range(5)), 2), [[0, 1], [2, 3], [4]])
+        self.assertEqual(split_into_shards(list(range(4)), 2), [[0, 1], [2, 3]])
+        self.assertEqual(split_into_shards([], 2), [])
+
+
+class WriteShardTests(SimpleTestCase):
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir, ignore_errors=True)
+
+    def _job(self, image_id, exists=True):
+        image_path = os.path.join(self.out_dir, f'img_{image_id}.jpg')
+        if exists:
+            cv2.imwrite(image_path, np.zeros((10, 20, 3), dtype=np.uint8))
+        return {
+            'id': image_id,
+            'stem': f'img_{image_id}',
+            'file_name': f'img_{image_id}.jpg',
+            'image_path': image_path,
+            # No stored size for a missing file, so rendering fails on it.
+            'width': 20 if exists else None,
+            'height': 10 if exists else None,
+            'num_classes': 2,
+            'shapes': [('car', 1, TRIANGLE)],
+        }
+
+    def _write(self, fmt, jobs):
+        return write_shard({'format': fmt, 'out_dir': self.out_dir, 'index': 3, 'jobs': jobs})
+
+    def test_tar_members_and_failed_sample(self):
+        entry = self._write('tar', [self._job(1), self._job(2, exists=False)])
+
+        self.assertEqual(entry['name'], 'shard-000003.tar')
+        self.assertEqual(entry['samples'], 1)
+        self.assertEqual(entry['image_ids'], [1, 2])
+        self.assertEqual(entry['failed_image_ids'], [2])
+
+        path = os.path.join(self.out_dir, entry['name'])
+        with tarfile.open(path) as tar:
+            self.assertEqual(tar.getnames(), ['00000001.jpg', '00000001.json', '00000001.mask.png', '00000001.inst.png'])
+            meta = json.load(tar.extractfile('00000001.json'))
+        self.assertEqual(meta['annotations'], [{'label': 'car', 'class_id': 1, 'points': [[0, 0], [4, 0], [4, 4]]}])
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+    def test_checksum_and_size_match_file(self):
+        entry = self._write('tar', [self._job(1)])
+        path = os.path.join(self.out_dir, entry['name'])
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(entry['sha256'], hashlib.sha256(data).hexdigest())
+        self.assertEqual(entry['bytes'], len(data))
+
+    @skipUnless(pq, "pyarrow not installed")
+    def test_parquet_schema_and_rows(self):
+        with mock.patch('annotator.sharding.PARQUET_ROW_GROUP_SIZE', 2):
+            entry = self._write('parquet', [self._job(1), self._job(2, exists=False), self._job(3), self._job(4)])
+
+        parquet = pq.ParquetFile(os.path.join(self.out_dir, entry['name']))
+        self.assertEqual(parquet.schema_arrow.names, [
+            'key', 'file_name', 'width', 'height', 'image', 'mask', 'instance_mask', 'labels', 'class_ids', 'polygons',
+        ])
+        self.assertEqual(parquet.metadata.num_rows, 3)
+        self.assertEqual(parquet.metadata.num_row_groups, 2)
+        self.assertEqual(entry['samples'], 3)
+        self.assertEqual(parquet.read(columns=['key']).column('key').to_pylist(), ['00000001', '00000003', '00000004'])
+
+
+@mock.patch('annotator.views.ProcessPoolExecutor', ThreadPoolExecutor)  # keep rendering in-process
+class ExportShardsTests(MediaRootTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.good = self.make_image('a.jpg', [{'label': 'car', 'points': TRIANGLE}])
+        self.broken = self.make_image('b.jpg', [{'label': 'tree', 'points': TRIANGLE}])
+        self._break_image(self.broken)
+
+    def _break_image(self, img_obj):
+        # Unreadable file and no stored size: rendering this sample fails.
+        with open(img_obj.image.path, 'wb') as f:
+            f.write(b'not an image')
+        record = img_obj.get_annotations()
+        del record['imagewidth'], record['imageheight']
+        AnnotatedImage.objects.filter(id=img_obj.id).update(annotations=json.dumps(record))
+
+    def _export(self, **query):
+        response = views.export_shards(RequestFactory().get('/export/shards/tar/', query), 'tar')
+        return response.status_code, json.loads(response.content)
+
+    def test_num_samples_excludes_failed_renders(self):
+        status, manifest = self._export()
+        self.assertEqual(status, 200)
+        self.assertEqual(manifest['num_shards'], 1)
+        self.assertEqual(manifest['num_samples'], 1)
+        self.assertEqual(manifest['shards'][0]['failed_image_ids'], [self.broken.id])
+
+    def test_rebuild_recomputes_num_samples(self):
+        self._export()
+        cv2.imwrite(self.broken.image.path, np.zeros((8, 8, 3), dtype=np.uint8))
+
+        status, manifest = self._export(shard=0)
+        self.assertEqual(status, 200)
+        self.assertEqual(manifest['num_samples'], 2)
+        self.assertEqual(manifest['shards'][0]['failed_image_ids'], [])
+
+    def test_rebuild_without_manifest_is_409(self):
+        status, _ = self._export(shard=0)
+        self.assertEqual(status, 409)
+
+    def test_rebuild_after_label_change_is_409(self):
+        self._export()
+        record = self.good.get_annotations()
+        record['annotations'].append({'label': 'bus', 'points': TRIANGLE})
+        AnnotatedImage.objects.filter(id=self.good.id).update(annotations=json.dumps(record))
+
+        status, _ = self._export(shard=0)
+        self.assertEqual(status, 409)
+
+    def test_rebuild_after_image_removed_is_409(self):
+        self._export()
+        self.good.delete()
+
+        status, _ = self._export(shard=0)
+        self.assertEqual(status, 409)
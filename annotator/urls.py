@@ -4,10 +4,15 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('upload/', views.upload_image, name='upload_image'),
+    path('upload-video/', views.upload_video, name='upload_video'),
+    path('upload-video/<int:job_id>/', views.video_ingest_status, name='video_ingest_status'),
    
 
     path('export/yolo/', views.export_yolo, name='export_yolo'),
     path('export/coco/', views.export_coco, name='export_coco'),
+    path('export/masks/', views.export_masks, name='export_masks'),
+    path('export/shards/<str:fmt>/', views.export_shards, name='export_shards'),
+    path('import/', views.import_dataset, name='import_dataset'),
     path('auto-detect/<int:image_id>/', views.auto_detect, name='auto_detect'),
 
     path('save-all/<int:image_id>/', views.save_all_data, name='save_all_data'),
@@ -0,0 +1,224 @@
+"""
+Video ingest: frame sampling, keyframe detection and optical-flow propagation.
+
+Clips are processed on a background worker rather than inside the upload request;
+progress is tracked on a VideoIngestJob row. Like autodetect.py this module does
+not load the detection weights at import.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.utils import timezone
+
+from .autodetect import get_or_run_auto_detect
+from .importers import polygon_entry, saved_record
+from .models import AnnotatedImage, VideoIngestJob
+
+# One clip at a time: inference is serialized anyway, and this bounds memory and DB connections.
+_ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='video-ingest')
+
+
+def iter_video_frames(video_path, stride=1, dedup_threshold=0.0):
+    """
+    Decodes a clip one frame at a time, yielding (frame_index, frame) for every
+    `stride`-th frame. Frames whose 64x64 grayscale thumbnail differs from the last
+    kept one by less than `dedup_threshold` (mean abs diff, 0-255) are skipped.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video")
+
+    last_thumb = None
+    frame_idx = -1
+    try:
+        while True:
+            ok = cap.grab()
+            if not ok: break
+            frame_idx += 1
+            if frame_idx % stride: continue
+
+            ok, frame = cap.retrieve()
+            if not ok: break
+
+            thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 64), interpolation=cv2.INTER_AREA)
+            if last_thumb is not None and dedup_threshold > 0:
+                diff = float(np.mean(cv2.absdiff(thumb, last_thumb)))
+                if diff < dedup_threshold: continue
+            last_thumb = thumb
+
+            yield frame_idx, frame
+    finally:
+        cap.release()
+
+
+def propagate_polygons(prev_gray, gray, annotations, min_tracked=0.6):
+    """
+    Moves polygon vertices from prev_gray to gray with pyramidal Lucas-Kanade flow.
+    Lost vertices follow the median motion of the tracked ones; polygons with too
+    few tracked vertices are dropped.
+    """
+    h, w = gray.shape[:2]
+    propagated = []
+
+    for ann in annotations:
+        points = ann.get('points', [])
+        if len(points) < 3: continue
+
+        pts = np.array([[p['x'], p['y']] for p in points], dtype=np.float32).reshape(-1, 1, 2)
+        new_pts, status, _ = cv2.calcOpticalFlowPyrLK(
+            prev_gray, gray, pts, None, winSize=(21, 21), maxLevel=3,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01),
+        )
+        if new_pts is None: continue
+
+        status = status.reshape(-1).astype(bool)
+        if status.mean() < min_tracked: continue
+
+        pts = pts.reshape(-1, 2)
+        new_pts = new_pts.reshape(-1, 2)
+        shift = np.median(new_pts[status] - pts[status], axis=0)
+        new_pts[~status] = pts[~status] + shift
+
+        new_pts[:, 0] = np.clip(new_pts[:, 0], 0, w - 1)
+        new_pts[:, 1] = np.clip(new_pts[:, 1], 0, h - 1)
+
+        moved = dict(ann)
+        moved['points'] = [{'x': float(x), 'y': float(y)} for x, y in new_pts]
+        moved['class'] = "propagated"
+        propagated.append(moved)
+
+    return propagated
+
+
+class KeyframeTracker:
+    """
+    Decides per kept frame whether to run the detector or propagate the previous
+    frame's polygons. Keyframes come every `keyframe_every` frames; a keyframe is
+    forced early only when propagation loses polygons that existed. An empty
+    keyframe stays empty until the next scheduled keyframe.
+    """
+
+    def __init__(self, keyframe_every):
+        self.keyframe_every = keyframe_every
+        self.prev_gray = None
+        self.prev_annotations = []
+        self.since_keyframe = 0
+
+    def step(self, gray, detect):
+        """
+        `detect` is a zero-argument callable returning annotations for this frame.
+        Returns (annotations, is_keyframe).
+        """
+        is_keyframe = self.prev_gray is None or self.since_keyframe >= self.keyframe_every
+        annotations = []
+        if not is_keyframe and self.prev_annotations:
+            annotations = propagate_polygons(self.prev_gray, gray, self.prev_annotations)
+            if not annotations:
+                is_keyframe = True  # tracking lost every polygon
+
+        if is_keyframe:
+            annotations = detect()
+            self.since_keyframe = 1
+        else:
+            self.since_keyframe += 1
+
+        self.prev_gray = gray
+        self.prev_annotations = annotations
+        return annotations, is_keyframe
+
+
+def build_saved_record(img_obj, width, height, annotations):
+    """
+    Wraps polygon annotations in the same JSON layout save_all_data() stores,
+    so ingested frames export like hand-annotated ones.
+    """
+    entries = [polygon_entry(ann.get('label', 'unknown'), ann['points']) for ann in annotations]
+    return saved_record(img_obj, width, height, entries)
+
+
+def ingest_video(video_path, video_name, custom_classes, stride=10, dedup_threshold=2.0, keyframe_every=10,
+                 stats=None, on_progress=None):
+    """
+    Streams a clip into AnnotatedImage frames. The detector only runs on keyframes
+    (see KeyframeTracker); frames in between get polygons propagated by optical flow on CPU.
+
+    Frames are committed one by one, so a failure mid-clip leaves the frames saved so
+    far in the DB. Pass in `stats` to still see how far it got (first/last_image_id);
+    `on_progress(stats)` is called after every frame.
+    """
+    stem = os.path.splitext(os.path.basename(video_name))[0]
+    if stats is None:
+        stats = {}
+    stats.update({'frames': 0, 'keyframes': 0, 'propagated': 0, 'first_image_id': None, 'last_image_id': None})
+
+    tracker = KeyframeTracker(keyframe_every)
+
+    for frame_idx, frame in iter_video_frames(video_path, stride, dedup_threshold):
+        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        if not ok: continue
+        data = buf.tobytes()
+
+        img_obj = AnnotatedImage.objects.create(
+            image=ContentFile(data, name=f"{stem}_f{frame_idx:06d}.jpg"),
+            content_hash=hashlib.sha256(data).hexdigest(),
+            source_video=video_name,
+            frame_index=frame_idx,
+        )
+        if stats['first_image_id'] is None:
+            stats['first_image_id'] = img_obj.id
+        stats['last_image_id'] = img_obj.id
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape[:2]
+
+        annotations, is_keyframe = tracker.step(gray, lambda: get_or_run_auto_detect(img_obj, custom_classes)[0])
+        stats['keyframes' if is_keyframe else 'propagated'] += 1
+
+        img_obj.annotations = json.dumps(build_saved_record(img_obj, w, h, annotations))
+        img_obj.save(update_fields=['annotations'])
+
+        stats['frames'] += 1
+        if on_progress:
+            on_progress(stats)
+
+    return stats
+
+
+def _update_job(job_id, **fields):
+    # queryset.update() skips auto_now, so bump updated_at by hand.
+    VideoIngestJob.objects.filter(id=job_id).update(updated_at=timezone.now(), **fields)
+
+
+def _run_ingest_job(job_id, video_path, custom_classes, stride, dedup_threshold, keyframe_every):
+    stats = {}
+    try:
+        _update_job(job_id, status=VideoIngestJob.RUNNING)
+        job = VideoIngestJob.objects.get(id=job_id)
+        ingest_video(video_path, job.video_name, custom_classes, stride, dedup_threshold, keyframe_every,
+                     stats, lambda current: _update_job(job_id, stats=json.dumps(current)))
+        _update_job(job_id, status=VideoIngestJob.DONE, stats=json.dumps(stats))
+        print(f"DEBUG: Video ingest {job_id} ({job.video_name}): {stats}")
+    except Exception as e:
+        # Frames saved before the failure are kept; the job's stats say which ones.
+        print(f"Video Ingest Error {job_id}: {e} (partial: {stats})")
+        _update_job(job_id, status=VideoIngestJob.FAILED, stats=json.dumps(stats), error=str(e))
+    finally:
+        if os.path.exists(video_path):
+            os.remove(video_path)
+        connection.close()
+
+
+def submit_ingest_job(job, video_path, custom_classes, stride=10, dedup_threshold=2.0, keyframe_every=10):
+    """
+    Queues a clip on the background worker. `video_path` must be a file the worker
+    may delete when done. Jobs queued or running when the process exits are not resumed.
+    """
+    return _ingest_executor.submit(
+        _run_ingest_job, job.id, video_path, custom_classes, stride, dedup_threshold, keyframe_every
+    )
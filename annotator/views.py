@@ -2,17 +2,15 @@ from django.shortcuts import render, get_object_or_404
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from .models import AnnotatedImage
+from .models import AnnotatedImage, VideoIngestJob
 import json
 import os
 import zipfile
 import io
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 import math
 import numpy as np
 import random
-from ultralytics import SAM, YOLO
-import torch
 import os
 import re
 import base64
@@ -21,12 +19,18 @@ import yaml
 from pycocotools import mask as mask_utils 
 from PIL import Image 
 import numpy as np
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from .rendering import render_image_masks, ZipStreamBuffer, mask_export_workers
+from .importers import import_coco, import_yolo, merge_stats
+from .sharding import SHARD_FORMATS, write_shard, split_into_shards, remove_stale_shards
+from .video import submit_ingest_job
+from .autodetect import (
+    DEFAULT_CONF, DEFAULT_IOU, DEFAULT_PROMPT, WARM_ON_UPLOAD,
+    get_or_run_auto_detect, normalize_classes, parse_threshold, warm_auto_detect_cache,
+)
 
 
-# model = YOLO('yolov8l-seg.pt')  
-detector = YOLO('yolov8l-worldv2.pt')
-segmenter = SAM('mobile_sam.pt') 
-
 def index(request):
     images = AnnotatedImage.objects.all().order_by('-uploaded_at')
     return render(request, 'annotator/index.html', {'images': images})
@@ -61,6 +65,9 @@ def upload_image(request):
                 else:
                     print(f"DEBUG: The directory {dir_path} does not even exist!")
 
+            if WARM_ON_UPLOAD:
+                warm_auto_detect_cache(annotated_image.id)
+
             return JsonResponse({'id': annotated_image.id, 'url': annotated_image.image.url})
             
         except Exception as e:
@@ -158,13 +165,26 @@ def png_to_rle(mask_path):
         print(f"RLE Conversion Error for {mask_path}: {e}")
         return None
 
+# --- HELPER: Shared Class Mapping For All Exporters ---
+def normalize_label(ann):
+    return ann.get('label', 'unknown').lower().strip()
+
+
+def register_class(class_map, label, start=0):
+    """
+    Assigns ids in first-seen order. YOLO counts from 0, COCO/masks from 1 (0 = background).
+    """
+    if label not in class_map:
+        class_map[label] = start + len(class_map)
+    return class_map[label]
+
+
 # --- EXPORT: YOLO FORMAT (Production Ready) ---
 def export_yolo(request):
-    all_images = AnnotatedImage.objects.exclude(annotations__isnull=True)
+    all_images = AnnotatedImage.objects.exclude(annotations__isnull=True).order_by('id')
     
     zip_buffer = io.BytesIO()
     class_map = {}
-    class_id_counter = 0
     
     with zipfile.ZipFile(zip_buffer, 'w') as zf:
         
@@ -183,13 +203,7 @@ def export_yolo(request):
                 yolo_lines = []
                 
                 for ann in db_data.get('annotations', []):
-                    label = ann.get('label', 'unknown').lower().strip()
-                    
-                    # Manage Classes
-                    if label not in class_map:
-                        class_map[label] = class_id_counter
-                        class_id_counter += 1
-                    cls_id = class_map[label]
+                    cls_id = register_class(class_map, normalize_label(ann), start=0)
                     
                     # Get Points
                     points = ann.get('points', [])
@@ -240,10 +254,9 @@ def export_coco(request):
     categories = []
     
     class_map = {}
-    class_id_counter = 1
     ann_id_counter = 1
     
-    all_db_images = AnnotatedImage.objects.exclude(annotations__isnull=True)
+    all_db_images = AnnotatedImage.objects.exclude(annotations__isnull=True).order_by('id')
 
     for img_obj in all_db_images:
         try:
@@ -262,12 +275,10 @@ def export_coco(request):
             
             # 2. Process Annotations
             for ann in db_data.get('annotations', []):
-                label = ann.get('label', 'unknown').lower().strip()
+                label = normalize_label(ann)
                 
                 if label not in class_map:
-                    class_map[label] = class_id_counter
-                    categories.append({"id": class_id_counter, "name": label, "supercategory": "none"})
-                    class_id_counter += 1
+                    categories.append({"id": register_class(class_map, label, start=1), "name": label, "supercategory": "none"})
                 
                 # A. Get Points & Calculate Tight BBox
                 points_data = ann.get('points', [])
@@ -333,71 +344,335 @@ def export_coco(request):
     return response
 
 
+# --- EXPORT: SEMANTIC / INSTANCE MASKS + PASCAL VOC ---
+def collect_mask_jobs(class_map=None, image_ids=None):
+    """
+    One cheap pass over the DB building per-image render jobs and a class map
+    (1-based, 0 = background). Ids must be fixed before any parallel rendering starts.
+    Pass an existing `class_map` / `image_ids` to rebuild against a previous export;
+    the map is extended in place if new labels show up, so callers can detect that.
+    """
+    class_map = {} if class_map is None else class_map
+    jobs = []
+
+    queryset = AnnotatedImage.objects.exclude(annotations__isnull=True).order_by('id')
+    if image_ids is not None:
+        queryset = queryset.filter(id__in=image_ids)
+
+    for img_obj in queryset:
+        try:
+            db_data = json.loads(img_obj.annotations)
+            if not db_data or 'annotations' not in db_data: continue
+
+            shapes = []
+            for ann in db_data.get('annotations', []):
+                # Register before skipping, like export_yolo/export_coco, so ids match across formats.
+                label = normalize_label(ann)
+                cls_id = register_class(class_map, label, start=1)
+                points = ann.get('points', [])
+                if len(points) < 3: continue
+                shapes.append((label, cls_id, points))
+
+            if not os.path.exists(img_obj.image.path):
+                print(f"Mask Export Error {img_obj.id}: image file missing")
+                continue
+
+            file_name = os.path.basename(img_obj.image.name)
+            jobs.append({
+                'id': img_obj.id,
+                'stem': os.path.splitext(file_name)[0],
+                'file_name': file_name,
+                'image_path': img_obj.image.path,
+                'width': db_data.get('imagewidth'),
+                'height': db_data.get('imageheight'),
+                'shapes': shapes,
+            })
+        except Exception as e:
+            print(f"Mask Export Error {img_obj.id}: {e}")
+
+    for job in jobs:
+        job['num_classes'] = len(class_map) + 1
+
+    return jobs, class_map
+
+
+def export_masks(request):
+    """
+    Streams a VOC-style zip: JPEGImages/, SegmentationClass/ (pixel = class id),
+    SegmentationObject/ (pixel = instance index, 16-bit), Annotations/ (VOC XML).
+    Rasterization runs in a process pool; zip bytes go out as each image finishes.
+    """
+    jobs, class_map = collect_mask_jobs()
+
+    def stream():
+        buf = ZipStreamBuffer()
+        written = []
+        with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED) as zf:
+            with ProcessPoolExecutor(max_workers=mask_export_workers()) as pool:
+                for job, result in zip(jobs, pool.map(render_image_masks, jobs, chunksize=4)):
+                    # Headers are already sent, so a failing image is skipped rather than aborting the zip.
+                    if 'error' in result:
+                        print(f"Mask Export Error {job['id']}: {result['error']}")
+                        continue
+                    try:
+                        with open(job['image_path'], 'rb') as f:
+                            image_bytes = f.read()
+                    except OSError as e:
+                        print(f"Mask Export Error {job['id']}: {e}")
+                        continue
+
+                    stem = result['stem']
+                    zf.writestr(f"JPEGImages/{job['file_name']}", image_bytes)
+                    zf.writestr(f"SegmentationClass/{stem}.png", result['class_png'])
+                    zf.writestr(f"SegmentationObject/{stem}.png", result['instance_png'])
+                    zf.writestr(f"Annotations/{stem}.xml", result['voc_xml'])
+                    written.append(stem)
+                    yield buf.pop()
+
+            zf.writestr("ImageSets/Segmentation/train.txt", "\n".join(written))
+            labels = ["background"] + sorted(class_map, key=class_map.get)
+            zf.writestr("labelmap.txt", "\n".join(f"{i} {name}" for i, name in enumerate(labels)))
+        yield buf.pop()
+
+    response = StreamingHttpResponse(stream(), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="voc_segmentation_masks.zip"'
+    return response
+
+
+# --- EXPORT: SHARDED (WebDataset tar / Parquet) ---
+def export_shards(request, fmt):
+    """
+    Writes fixed-size shards to MEDIA_ROOT/exports/shards/<fmt>-<size>/ in parallel
+    and returns the manifest (per-shard sample count, size, sha256, url).
+    `?shard=N` rebuilds only that shard from the image ids and class map recorded
+    in the manifest, and refuses (409) if those labels or images have changed.
+    A full export deletes shard files left over from a larger previous export.
+    """
+    if fmt not in SHARD_FORMATS:
+        return JsonResponse({'error': f'Unsupported format: {fmt}'}, status=400)
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return JsonResponse({'error': 'Parquet export requires pyarrow'}, status=400)
+
+    try:
+        samples_per_shard = max(1, int(request.GET.get('samples_per_shard', 1000)))
+        only_shard = request.GET.get('shard')
+        only_shard = int(only_shard) if only_shard is not None else None
+    except ValueError:
+        return JsonResponse({'error': "'samples_per_shard' and 'shard' must be integers"}, status=400)
+
+    try:
+        export_name = f"{fmt}-{samples_per_shard}"
+        out_dir = os.path.join(settings.MEDIA_ROOT, 'exports', 'shards', export_name)
+        os.makedirs(out_dir, exist_ok=True)
+        manifest_path = os.path.join(out_dir, 'manifest.json')
+
+        if only_shard is None:
+            jobs, class_map = collect_mask_jobs()
+            shards = split_into_shards(jobs, samples_per_shard)
+            tasks = [{'format': fmt, 'out_dir': out_dir, 'index': i, 'jobs': shard} for i, shard in enumerate(shards)]
+        else:
+            # Rebuild against the existing manifest so untouched shards stay consistent with it.
+            if not os.path.exists(manifest_path):
+                return JsonResponse({'error': 'No previous export found; run a full export first'}, status=409)
+            with open(manifest_path) as f:
+                previous = json.load(f)
+            entries = {e['index']: e for e in previous.get('shards', [])}
+            if only_shard not in entries:
+                return JsonResponse({'error': f'Shard {only_shard} out of range (0-{previous["num_shards"] - 1})'}, status=400)
+
+            class_map = {name: int(cls_id) for cls_id, name in previous['classes'].items()}
+            known_classes = len(class_map)
+            shard_ids = entries[only_shard]['image_ids']
+            jobs, _ = collect_mask_jobs(class_map, shard_ids)
+
+            if len(class_map) != known_classes or [job['id'] for job in jobs] != shard_ids:
+                return JsonResponse({
+                    'error': 'Labels or images in this shard changed since the last full export; '
+                             'run a full export instead'
+                }, status=409)
+            tasks = [{'format': fmt, 'out_dir': out_dir, 'index': only_shard, 'jobs': jobs}]
+
+        with ProcessPoolExecutor(max_workers=mask_export_workers()) as pool:
+            written = list(pool.map(write_shard, tasks))
+        for entry in written:
+            entry['url'] = f"{settings.MEDIA_URL}exports/shards/{export_name}/{entry['name']}"
+
+        if only_shard is None:
+            remove_stale_shards(out_dir, {entry['name'] for entry in written})
+            manifest = {
+                "format": fmt,
+                "samples_per_shard": samples_per_shard,
+                "num_samples": sum(entry['samples'] for entry in written),  # failed renders excluded
+                "num_shards": len(written),
+                "classes": {cls_id: name for name, cls_id in class_map.items()},
+                "shards": written,
+            }
+        else:
+            entries[only_shard] = written[0]
+            shards = [entries[i] for i in sorted(entries)]
+            manifest = dict(previous, shards=shards, num_samples=sum(entry['samples'] for entry in shards))
+
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_path, manifest_path)
+
+        print(f"DEBUG: Wrote {len(written)} {fmt} shard(s) to {out_dir}")
+        return JsonResponse(manifest)
+
+    except Exception as e:
+        print(f"Shard Export Error: {e}")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
 def auto_detect(request, image_id):
     try:
         img_obj = AnnotatedImage.objects.get(id=image_id)
-        image_path = img_obj.image.path
         
-        default_prompt = "car, person, tree, cloud, building"
-        user_prompt = request.GET.get('prompt', default_prompt)
+        user_prompt = request.GET.get('prompt', DEFAULT_PROMPT)
+        conf, conf_error = parse_threshold(request, 'conf', DEFAULT_CONF)
+        iou, iou_error = parse_threshold(request, 'iou', DEFAULT_IOU)
+        if conf_error or iou_error:
+            return JsonResponse({'error': conf_error or iou_error}, status=400)
         print(f"DEBUG: Step 1 - Detecting [{user_prompt}] with YOLO-World...")
         
 
-        custom_classes = [x.strip() for x in user_prompt.split(',')]
-        detector.set_classes(custom_classes)
-        
-    
-        detect_results = detector.predict(image_path, conf=0.15, iou=0.5)
-        det_result = detect_results[0]
-        
-        new_annotations = []
+        custom_classes = normalize_classes(user_prompt)
+        if not custom_classes:
+            return JsonResponse({'error': 'Prompt contains no classes'}, status=400)
 
-        if det_result.boxes:
-            print(f"DEBUG: Step 2 - Found {len(det_result.boxes)} boxes. Refining with SAM...")
-            
-            bboxes = det_result.boxes.xyxy 
-
-            seg_results = segmenter(image_path, bboxes=bboxes)
-            seg_result = seg_results[0]
+        new_annotations, cached = get_or_run_auto_detect(img_obj, custom_classes, conf, iou)
 
-            if seg_result.masks:
-                for i, mask in enumerate(seg_result.masks.xy):
-                    
-
-                    if len(mask) < 3: continue
-
-                    points = [{'x': float(pt[0]), 'y': float(pt[1])} for pt in mask]
-                    
-                    cls_id = int(det_result.boxes.cls[i].item())
-                    if cls_id < len(custom_classes):
-                        label_name = custom_classes[cls_id]
-                    else:
-                        label_name = "object"
-
-                    color = "#%06x" % random.randint(0, 0xFFFFFF)
-
-                    annotation = {
-                        "type": "polygon",  
-                        "points": points,
-                        "label": label_name,
-                        "class": "auto-detected",
-                        "stroke": color,
-                        "fill": color + "40", 
-                        "left": 0,
-                        "top": 0,
-                        "width": 0,
-                        "height": 0
-                    }
-                    new_annotations.append(annotation)
-
-        print(f"DEBUG: Success! Generated {len(new_annotations)} polygons.")
-        return JsonResponse({'success': True, 'annotations': new_annotations})
+        print(f"DEBUG: Success! Generated {len(new_annotations)} polygons (cached={cached}).")
+        return JsonResponse({'success': True, 'annotations': new_annotations, 'cached': cached})
 
     except Exception as e:
         print(f"AI Error: {e}")
         return JsonResponse({'error': str(e)}, status=500)
 
 
+# --- VIDEO INGEST: runs on a background worker, see video.py ---
+@csrf_exempt
+def upload_video(request):
+    """
+    Queues a clip for ingest and returns immediately with a job id (202).
+    Poll upload-video/<job_id>/ for progress and the resulting image ids.
+    """
+    if request.method == 'POST':
+        if 'video' not in request.FILES:
+            return JsonResponse({'error': 'No video provided'}, status=400)
+
+        video_file = request.FILES['video']
+        custom_classes = normalize_classes(request.POST.get('prompt', DEFAULT_PROMPT))
+        if not custom_classes:
+            return JsonResponse({'error': 'Prompt contains no classes'}, status=400)
+
+        try:
+            stride = max(1, int(request.POST.get('stride', 10)))
+            dedup_threshold = float(request.POST.get('dedup_threshold', 2.0))
+            keyframe_every = max(1, int(request.POST.get('keyframe_every', 10)))
+        except ValueError:
+            return JsonResponse({'error': "'stride', 'dedup_threshold' and 'keyframe_every' must be numbers"}, status=400)
+
+        tmp_path = None
+        try:
+            # The upload's own temp file is removed when the request ends, so the
+            # worker always gets a copy it owns (and deletes when done).
+            suffix = os.path.splitext(video_file.name)[1]
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+                tmp_path = tmp.name
+                for chunk in video_file.chunks():
+                    tmp.write(chunk)
+
+            job = VideoIngestJob.objects.create(video_name=video_file.name)
+            submit_ingest_job(job, tmp_path, custom_classes, stride, dedup_threshold, keyframe_every)
+            tmp_path = None
+            return JsonResponse({'success': True, 'job_id': job.id, 'status': job.status}, status=202)
+
+        except Exception as e:
+            print(f"Video Upload Error: {e}")
+            return JsonResponse({'error': str(e)}, status=500)
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return JsonResponse({'error': 'Invalid request'}, status=400)
+
+
+def video_ingest_status(request, job_id):
+    job = get_object_or_404(VideoIngestJob, id=job_id)
+    return JsonResponse({
+        'job_id': job.id,
+        'video_name': job.video_name,
+        'status': job.status,
+        'error': job.error,
+        **job.get_stats(),
+    })
+
+
+# --- IMPORT: Existing COCO / YOLO Datasets ---
+@csrf_exempt
+def import_dataset(request):
+    """
+    Accepts a zip with either a COCO json (+ images) or a YOLO layout
+    (images/, labels/, data.yaml) and bulk-imports it.
+    """
+    if request.method == 'POST':
+        if 'dataset' not in request.FILES:
+            return JsonResponse({'error': 'No dataset provided'}, status=400)
+
+        fmt = request.POST.get('format', 'coco').lower()
+        if fmt not in ('coco', 'yolo'):
+            return JsonResponse({'error': f'Unsupported format: {fmt}'}, status=400)
+
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                with zipfile.ZipFile(request.FILES['dataset']) as zf:
+                    zf.extractall(tmp_dir)
+
+                if fmt == 'yolo':
+                    stats = import_yolo(tmp_dir)
+                else:
+                    json_files, image_lookup = [], {}
+                    for root, dirs, files in os.walk(tmp_dir):
+                        dirs.sort()
+                        for name in sorted(files):
+                            if name.lower().endswith('.json'):
+                                json_files.append(os.path.join(root, name))
+                            else:
+                                image_lookup.setdefault(name, os.path.join(root, name))
+                    if not json_files:
+                        return JsonResponse({'error': 'No COCO json found in archive'}, status=400)
+
+                    # Every json is imported (e.g. instances_train.json + instances_val.json).
+                    per_file = {}
+                    for json_path in json_files:
+                        images_dir = os.path.join(tmp_dir, 'images')
+                        if not os.path.isdir(images_dir):
+                            images_dir = os.path.dirname(json_path)
+                        per_file[os.path.relpath(json_path, tmp_dir)] = import_coco(
+                            json_path, images_dir, image_lookup=image_lookup
+                        )
+                    stats = merge_stats(per_file.values())
+                    stats['files'] = per_file
+
+            print(f"DEBUG: {fmt.upper()} import finished: {stats}")
+            return JsonResponse({'success': True, **stats})
+
+        except ValueError as e:
+            # Malformed archive contents, e.g. data.yaml files with conflicting class names.
+            print(f"Import Error: {e}")
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            print(f"Import Error: {e}")
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Invalid request'}, status=400)
+
+
 @csrf_exempt
 def save_all_data(request, image_id):
     if request.method == 'POST':